@@ -2,6 +2,7 @@ import os
 import csv
 import re
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 # Define the base directory where COIN_NPS_Start_Run_* folders are located
 base_dir = "/w/hallc-scshelf2102/nps/cploen/metadata_files/"
@@ -17,23 +18,38 @@ config_groups = defaultdict(list)
 # Pattern to extract run number from folder name
 run_pattern = re.compile(r'COIN_NPS_Start_Run_(\d{4})')
 
-# Loop through all folders in COIN directory
-for folder in os.listdir(search_dir):
-    match = run_pattern.match(folder)
-    if match:
-        run_number = int(match.group(1))  # Convert to integer for proper sorting
-        file_path = os.path.join(search_dir, folder, "nps-vme1.dat")  # Fixed incorrect path
-        
-        if os.path.isfile(file_path):
-            with open(file_path, "r") as f:
-                lines = f.readlines()
-                
-                # Extract FA250 Config line
-                for line in lines:
-                    if line.startswith("# FA250 Config:"):
-                        fa250_config = line.split(": ")[-1].strip()
-                        config_groups[fa250_config].append(run_number)
-                        break
+# Function to pull the FA250 config out of one run's nps-vme1.dat
+def extract_cfg(candidate):
+    """Returns (run_number, FA250 config) for a run, with config None if the file or header is missing."""
+    run_number, file_path = candidate
+    try:
+        # Stream the file in binary and stop at the FA250 Config header line (near the top)
+        with open(file_path, "rb") as f:
+            for line in f:
+                if line.startswith(b"# FA250 Config:"):
+                    return run_number, line.decode().split(": ")[-1].strip()
+    except (FileNotFoundError, IsADirectoryError):
+        pass
+    return run_number, None
+
+# Collect (run number, vme file) pairs for all run folders in COIN directory
+# (scandir reports the entry type from the directory listing, so no extra stat per folder)
+candidates = []
+with os.scandir(search_dir) as it:
+    for entry in it:
+        if not entry.is_dir():
+            continue
+        match = run_pattern.match(entry.name)
+        if match:
+            run_number = int(match.group(1))  # Convert to integer for proper sorting
+            file_path = os.path.join(entry.path, "nps-vme1.dat")  # Fixed incorrect path
+            candidates.append((run_number, file_path))
+
+# Read the vme files concurrently: each open/read mostly waits on filesystem metadata round trips
+with ThreadPoolExecutor(32) as executor:
+    for run_number, fa250_config in executor.map(extract_cfg, candidates):
+        if fa250_config is not None:
+            config_groups[fa250_config].append(run_number)
 
 # Save each group to a separate CSV file
 for config, runs in config_groups.items():
@@ -47,7 +63,6 @@ for config, runs in config_groups.items():
     with open(csv_filename, "w", newline="") as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["Run Number", "FA250 Config"])
-        for run in runs:
-            writer.writerow([run, config])
+        writer.writerows([(run, config) for run in runs])
 
     print(f"Saved: {csv_filename}")
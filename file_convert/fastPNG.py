@@ -3,17 +3,12 @@ import argparse
 import time
 import datetime
 import shutil
-from pdf2image import convert_from_path
+import queue
+from collections import OrderedDict
+from functools import partial
+import fitz  # PyMuPDF
 from tqdm import tqdm
-from multiprocessing import Pool, cpu_count
-
-# Try importing PDFPageCountError, otherwise define a fallback
-try:
-    from pdf2image.exceptions import PDFPageCountError
-except ImportError:
-    class PDFPageCountError(Exception):
-        """Fallback error class if pdf2image doesn't provide PDFPageCountError."""
-        pass
+from multiprocessing import Pool, Queue, cpu_count
 
 # Function to read filenames from a text file
 def read_filenames(filename_list):
@@ -25,9 +20,12 @@ def read_filenames(filename_list):
 def check_pdf(pdf_path):
     """Attempts to read the page count of a PDF to verify it is not corrupted."""
     try:
-        _ = len(convert_from_path(pdf_path, dpi=10))  # Low DPI for fast check
+        # Opening only parses the trailer/xref and page tree; nothing is rasterized
+        with fitz.open(pdf_path) as doc:
+            if doc.page_count == 0:
+                return f"ERROR: {pdf_path} has no pages. PDF might be corrupted. Skipping.\n"
         return None  # No error
-    except PDFPageCountError as e:
+    except fitz.FileDataError as e:
         return f"ERROR: Unable to process {pdf_path}. PDF might be corrupted. Skipping.\n{str(e)}\n"
     except Exception as e:
         return f"ERROR: Unexpected failure while processing {pdf_path}. Skipping.\n{str(e)}\n"
@@ -42,32 +40,120 @@ def check_disk_space(required_gb=10):
         return False
     return True
 
-# Function to convert a single PDF and rename output images
-def convert_pdf(pdf_info):
-    """Converts a PDF file to PNG images using multiprocessing, with error handling."""
-    pdf_path, filenames, dpi = pdf_info
-    pdf_dir = os.path.dirname(pdf_path)
-    
-    # Check if PNGs already exist
-    all_pngs_exist = all(os.path.exists(os.path.join(pdf_dir, filenames[i])) for i in range(len(filenames)))
-    if all_pngs_exist:
-        print(f"⏩ Skipping already processed PDF: {pdf_path}")
-        return  # Skip this PDF
-
-    start_time = time.time()  # Start timing
+# Function to list one logical CPU per physical core available to this process
+def physical_cores():
+    """Returns one logical CPU id per physical core (skipping SMT siblings), using /proc/cpuinfo."""
+    allowed = sorted(os.sched_getaffinity(0))
     try:
-        images = convert_from_path(pdf_path, dpi=dpi, fmt="png", thread_count=cpu_count())
-        for i, image in enumerate(images):
-            filename = filenames[i] if i < len(filenames) else f"default_page_{i+1}.png"
-            image.save(os.path.join(pdf_dir, filename), "PNG")
-
-        end_time = time.time()
-        print(f"✅ Processed {pdf_path} in {end_time - start_time:.2f} sec")
+        with open("/proc/cpuinfo", "r") as f:
+            blocks = f.read().strip().split("\n\n")
+    except OSError:
+        return allowed  # Not Linux or no procfs: use every allowed CPU
+
+    cores, seen = [], set()
+    for block in blocks:
+        info = {}
+        for line in block.splitlines():
+            key, _, value = line.partition(":")
+            info[key.strip()] = value.strip()
+        if "processor" not in info:
+            continue
+        cpu = int(info["processor"])
+        core = (info.get("physical id"), info.get("core id", cpu))
+        if cpu in allowed and core not in seen:
+            seen.add(core)
+            cores.append(cpu)
+    return cores or allowed
+
+# Functions to pin pool workers to distinct cores
+def pin_to_core(core_id):
+    """Restricts the calling process to a single CPU so the scheduler can't migrate it."""
+    os.sched_setaffinity(0, {core_id})
+
+def _pin(core_ids_queue):
+    """Pool initializer: takes the next free core id from the queue and pins this worker to it."""
+    try:
+        core_id = core_ids_queue.get(timeout=1)
+    except queue.Empty:
+        return  # Replacement worker after the queue was drained: leave it unpinned
+    if core_id is not None:  # None: more workers than CPUs, so this one stays unpinned
+        pin_to_core(core_id)
+
+def pinned_pool(num_workers):
+    """Creates a Pool whose workers are each pinned to their own CPU, physical cores first (Linux only)."""
+    if not hasattr(os, "sched_setaffinity"):
+        return Pool(num_workers)
+    # One CPU per physical core first, then the SMT siblings; never two workers on one CPU
+    cores = physical_cores()
+    cpus = cores + [cpu for cpu in sorted(os.sched_getaffinity(0)) if cpu not in cores]
+    core_ids = Queue()
+    for i in range(num_workers):
+        core_ids.put(cpus[i] if i < len(cpus) else None)
+    return Pool(num_workers, initializer=_pin, initargs=(core_ids,))
+
+# Per-worker cache of open PDF documents, so consecutive pages of one PDF reuse the parsed file
+_DOC_CACHE_SIZE = 4
+_doc_cache = OrderedDict()
+_failed_pdfs = set()  # PDFs this worker could not open, so their other pages don't retry them
+
+def open_cached(pdf_path):
+    """Returns an open fitz.Document for 'pdf_path', keeping the most recently used few open."""
+    doc = _doc_cache.pop(pdf_path, None)
+    if doc is None:
+        doc = fitz.open(pdf_path)
+        if len(_doc_cache) >= _DOC_CACHE_SIZE:
+            _, oldest = _doc_cache.popitem(last=False)
+            oldest.close()
+    _doc_cache[pdf_path] = doc
+    return doc
+
+# Function to render a single page of a PDF to a named PNG
+def render_page(task, dpi=300):
+    """Renders one page of a PDF to a PNG image next to the PDF, with error handling.
+
+    An 'out_path' of None renders every page from 'page_idx' on as default_page_N.png
+    (pages beyond the filename list).
+    """
+    pdf_path, page_idx, out_path = task
+    if pdf_path in _failed_pdfs:
+        return
 
-    except PDFPageCountError:
-        log_error(f"ERROR: Skipping corrupt PDF {pdf_path}")
+    try:
+        doc = open_cached(pdf_path)
     except Exception as e:
-        log_error(f"ERROR: Unexpected failure in {pdf_path}: {str(e)}")
+        _failed_pdfs.add(pdf_path)
+        if page_idx == 0:  # Every PDF has a page 0 task, so the failure is logged once per PDF
+            if isinstance(e, fitz.FileDataError):
+                log_error(f"ERROR: Skipping corrupt PDF {pdf_path}")
+            else:
+                log_error(f"ERROR: Unexpected failure in {pdf_path}: {str(e)}")
+        return
+
+    pdf_dir = os.path.dirname(pdf_path)
+    pages = [(page_idx, out_path)] if out_path else \
+        [(i, os.path.join(pdf_dir, f"default_page_{i+1}.png")) for i in range(page_idx, doc.page_count)]
+    for i, path in pages:
+        if i >= doc.page_count:
+            return  # PDF has fewer pages than the filename list
+        try:
+            doc[i].get_pixmap(dpi=dpi).save(path)
+        except Exception as e:
+            log_error(f"ERROR: Unexpected failure in {pdf_path} (page {i + 1}): {str(e)}")
+
+# Function to find the PDFs inside the run subdirectories
+def find_pdfs(parent_dir):
+    """Lists every PDF inside 'COIN_NPS_50k_replay_*/' directories, walking each directory once."""
+    # scandir's DirEntry carries the file type from the directory listing, so no extra stat per entry.
+    # Scanning with a bytes path skips decoding every name; only the PDFs found are decoded to str.
+    with os.scandir(os.fsencode(parent_dir)) as it:
+        run_dirs = sorted([e.path for e in it
+                           if e.name.startswith(b"COIN_NPS_50k_replay_") and e.is_dir()])
+    return [os.fsdecode(e.path) for run_dir in run_dirs for e in os.scandir(run_dir) if e.name.endswith(b".pdf")]
+
+def _all_outputs_exist(pdf_path, filenames):
+    """Returns True if every expected PNG for this PDF is already next to it."""
+    pdf_dir = os.path.dirname(pdf_path)
+    return all(os.path.isfile(os.path.join(pdf_dir, fn)) for fn in filenames)
 
 # Function to log errors to a file
 
@@ -91,14 +177,12 @@ def batch_check_pdfs(parent_dir, num_workers):
     timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
     log_filename = f"error_log_{timestamp}.txt"  # ✅ Generate timestamped log file
 
-    run_dirs = sorted([os.path.join(parent_dir, d) for d in os.listdir(parent_dir) 
-                       if os.path.isdir(os.path.join(parent_dir, d)) and d.startswith("COIN_NPS_50k_replay_")])
-
-    pdf_files = [os.path.join(run_dir, f) for run_dir in run_dirs for f in os.listdir(run_dir) if f.endswith(".pdf")]
+    pdf_files = find_pdfs(parent_dir)
     print(f"🔍 Checking {len(pdf_files)} PDFs for errors using {num_workers} cores...\n")
 
-    with Pool(num_workers) as pool:
-        results = list(tqdm(pool.imap_unordered(check_pdf, pdf_files), total=len(pdf_files), desc="Checking PDFs"))
+    with pinned_pool(num_workers) as pool:
+        results = list(tqdm(pool.imap_unordered(check_pdf, pdf_files, chunksize=16),
+                            total=len(pdf_files), desc="Checking PDFs"))
 
     with open(log_filename, "w") as log_file:  # ✅ Now uses the timestamped log file
         for error_msg in results:
@@ -117,16 +201,27 @@ def batch_convert(parent_dir, filename_list, dpi, num_workers):
         exit(1)
 
     start_time = time.time()
-    run_dirs = sorted([os.path.join(parent_dir, d) for d in os.listdir(parent_dir) 
-                       if os.path.isdir(os.path.join(parent_dir, d)) and d.startswith("COIN_NPS_50k_replay_")])
-
     filenames = read_filenames(filename_list)
-    pdf_files = [os.path.join(run_dir, f) for run_dir in run_dirs for f in os.listdir(run_dir) if f.endswith(".pdf")]
-
-    print(f"📄 Processing {len(pdf_files)} PDFs at {dpi} DPI using {num_workers} cores...\n")
-
-    with Pool(num_workers) as pool:
-        pool.map(convert_pdf, [(pdf, filenames, dpi) for pdf in pdf_files])
+    pdf_files = find_pdfs(parent_dir)
+
+    # Skip PDFs whose PNGs already exist before any task is built for them
+    todo = [pdf for pdf in pdf_files if not _all_outputs_exist(pdf, filenames)]
+    if len(todo) < len(pdf_files):
+        print(f"⏩ Skipping {len(pdf_files) - len(todo)} already processed PDFs")
+
+    # One task per page, so a single pool parallelizes across pages and PDFs alike
+    # Output paths are resolved here once, so workers do no path joins or list lookups per page
+    tasks = [(pdf, page_idx, os.path.join(os.path.dirname(pdf), out_name))
+             for pdf in todo for page_idx, out_name in enumerate(filenames)]
+    print(f"📄 Processing {len(todo)} PDFs ({len(tasks)} pages) at {dpi} DPI using {num_workers} cores...\n")
+
+    # Plus one task per PDF for any pages beyond the filename list (saved as default_page_N.png)
+    tasks += [(pdf, len(filenames), None) for pdf in todo]
+
+    with pinned_pool(num_workers) as pool:
+        for _ in tqdm(pool.imap_unordered(partial(render_page, dpi=dpi), tasks, chunksize=8),
+                      total=len(tasks), desc="Rendering pages"):
+            pass
 
     print("\n✅ Conversion complete!")
     print(f"⏳ Total Execution Time: {time.time() - start_time:.2f} seconds")
@@ -6,24 +6,49 @@ import urllib.parse
 import time
 import os
 import re
+import shutil
+import itertools
 import logging
-from bs4 import BeautifulSoup
+from functools import partial
+from tqdm import tqdm
 from datetime import datetime
-
-start_time = time.time()
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # URLs
 BASE_URL = "https://logbooks.jlab.org/"
 LOGIN_URL = "https://logbooks.jlab.org/entries?destination=entries"
 SEARCH_URL = "https://logbooks.jlab.org/entries"
 
-# Set up logging configuration
-logging.basicConfig(
-    filename="debug.log",  # Log to a file
-    level=logging.DEBUG,  # Capture all debug messages
-    format="%(asctime)s - %(levelname)s - %(message)s",  # Include timestamp
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+# Number of log entries processed in parallel, and of parallel file downloads (all share one session)
+ENTRY_WORKERS = 8
+DOWNLOAD_WORKERS = 16
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB per read/write
+
+# Number of search result pages fetched in parallel
+PAGE_WORKERS = 8
+
+# Hidden Drupal form fields, read straight from the raw page bytes (no HTML parse needed)
+FORM_BUILD_RE = re.compile(rb'name="form_build_id"[^>]*value="([^"]+)"')
+FORM_TOKEN_RE = re.compile(rb'name="form_token"[^>]*value="([^"]+)"')
+
+# A logout link only appears once logged in; searched case-insensitively on the raw bytes (no lowercase copy)
+LOGOUT_RE = re.compile(rb"logout", re.IGNORECASE)
+
+# Run number in an entry title, compiled once
+RUN_RE = re.compile(r"50k replay plots for run (\d+)", re.IGNORECASE)
+
+# XPath queries for the result and entry pages (compiled in main(), where lxml is first imported)
+ENTRY_XPATH = "//a[starts-with(@href, '/entry/')]"
+PAGER_LAST_XPATH = ("//*[contains(concat(' ', normalize-space(@class), ' '), ' pager-last ')]"
+                    "/descendant-or-self::a/@href")
+
+def file_xpath(file_types):
+    """Builds an XPath matching links that end in any of the file types (XPath 1.0 has no ends-with)."""
+    return "//a[" + " or ".join(
+        f"substring(@href, string-length(@href) - {len(ext) - 1}) = '{ext}'" for ext in file_types
+    ) + "]/@href"
 
 # Load settings from a JSON file
 def load_settings(filename="settings.json"):
@@ -38,27 +63,21 @@ def load_settings(filename="settings.json"):
         print(f"❌ Error reading '{filename}'. Please check JSON formatting.")
         exit(1)
 
-settings = load_settings()
-
 # Parse command-line arguments
-parser = argparse.ArgumentParser("JLab Logbook Webscraper - Search and download logbook entries.")
-parser.add_argument("--quiet", action="store_true", help="Suppress terminal output and save results to a file only")
-parser.add_argument("--no-download", action="store_true", help="Skip file downloads")
-parser.add_argument("--debug", action="store_true", help="Enable debugging mode (includes detailed output and disables downloads)")
-parser.add_argument("--filter", action="store_true", help="Enable filtering of search results based on settings.json")
+def parse_args():
+    """Parses the command-line flags and search terms."""
+    parser = argparse.ArgumentParser("JLab Logbook Webscraper - Search and download logbook entries.")
+    parser.add_argument("--quiet", action="store_true", help="Suppress terminal output and save results to a file only")
+    parser.add_argument("--no-download", action="store_true", help="Skip file downloads")
+    parser.add_argument("--debug", action="store_true", help="Enable debugging mode (includes detailed output and disables downloads)")
+    parser.add_argument("--filter", action="store_true", help="Enable filtering of search results based on settings.json")
 
-parser.add_argument("--start-date", type=str, default="2023-09-01", help="Start date (YYYY-MM-DD)")
-parser.add_argument("--end-date", type=str, default="2024-06-01", help="End date (YYYY-MM-DD)")
-parser.add_argument("--logbook", type=str, default="84", help="Logbook ID to search (Default: 84)")
-parser.add_argument("--search", type=str, default="COIN_NPS Start_Run_", help="Search keyword (Default: 'COIN_NPS Start_Run_')")
+    parser.add_argument("--start-date", type=str, default="2023-09-01", help="Start date (YYYY-MM-DD)")
+    parser.add_argument("--end-date", type=str, default="2024-06-01", help="End date (YYYY-MM-DD)")
+    parser.add_argument("--logbook", type=str, default="84", help="Logbook ID to search (Default: 84)")
+    parser.add_argument("--search", type=str, default="COIN_NPS Start_Run_", help="Search keyword (Default: 'COIN_NPS Start_Run_')")
 
-args = parser.parse_args()
-
-# Ensure debug mode forces no-download
-if args.debug:
-    args.no_download = True  # Debug mode should not download files
-    print("🛠️ Debugging mode enabled. Downloads are disabled.")
-    logging.info("Debugging mode enabled. Downloads are disabled.")
+    return parser.parse_args()
 
 # Ensure dates are properly formatted
 def validate_date(date_str):
@@ -70,260 +89,429 @@ def validate_date(date_str):
         print(f"❌ Invalid date format: {date_str}. Use YYYY-MM-DD.")
         exit(1)  # Stop execution if date is invalid
 
-start_date = validate_date(args.start_date)
-end_date = validate_date(args.end_date)
-
-# Get username & password securely
-USERNAME = input("Enter your JLab username: ")
-PASSWORD = getpass.getpass("Enter your JLab password: ")
-
-# Start a session
-session = requests.Session()
-
-# Step 1: Fetch login page to get `form_build_id`
-login_page = session.get(BASE_URL)
-soup = BeautifulSoup(login_page.text, "html.parser")
-
-# Extract form_build_id for login
-form_build_input = soup.find("input", {"name": "form_build_id"})
-form_build_id = form_build_input["value"] if form_build_input else None
-
-# Debugging
-if args.debug and form_build_id:
-    logging.debug(f"🔹 Extracted form_build_id: {form_build_id}")
-elif args.debug:
-    logging.warning("⚠️ No form_build_id found. Login may fail.")
-
-# Step 2: Define login payload
-login_payload = {
-    "name": USERNAME,
-    "pass": PASSWORD,
-    "form_build_id": form_build_id,
-    "form_id": "user_login_block",
-    "op": "Log in"
-}
-
-# Step 3: Send login request
-headers = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-    "Referer": BASE_URL,
-    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-    "Content-Type": "application/x-www-form-urlencoded",
-    "Origin": "https://logbooks.jlab.org",
-    "Connection": "keep-alive",
-    "Upgrade-Insecure-Requests": "1"
-}
-
-response = session.post(LOGIN_URL, data=login_payload, headers=headers)
-
-# Step 4: Check if login was successful
-if response.ok and "logout" in response.text.lower():
-    print("✅ Login successful!")
-else:
-    print("❌ Login failed! The website may require additional fields.")
-    exit()
-
-# Step 5: Fetch the search page to get `form_build_id` and `form_token`
-search_page = session.get(SEARCH_URL)
-soup = BeautifulSoup(search_page.text, "lxml")
-
-# Extract new form_build_id and form_token for the search form
-form_build_input = soup.find("input", {"name": "form_build_id"})
-form_token_input = soup.find("input", {"name": "form_token"})
-
-form_build_id = form_build_input["value"] if form_build_input else None
-form_token = form_token_input["value"] if form_token_input else None
-
-# Debugging
-if args.debug and form_build_id and form_token:
-    logging.debug(f"🔹 Extracted search form_build_id: {form_build_id}")
-    logging.debug(f"🔹 Extracted search form_token: {form_token}")
-elif args.debug:
-    logging.warning("⚠️ No form_build_id or form_token found for search. Search may fail.")
-    exit()
-
-# Step 6: Define search payload
-search_payload = {
-    "start_date": start_date,
-    "end_date": end_date,
-    "logbooks[0]": args.logbook,  
-    "search_str": args.search,
-    "group_by": "SHIFT",
-    "listing_format": "table",
-    "entries_per_page": "100",
-    "form_build_id": form_build_id,
-    "form_token": form_token,
-    "form_id": "elog_form_advanced_filters",
-    "op": "Submit"
-}
-# Encode the parameters correctly for a GET request
-encoded_search_url = f"https://logbooks.jlab.org/entries?{urllib.parse.urlencode(search_payload)}"
-
-# Step 7: Send the search request
-search_response = session.get(encoded_search_url, headers=headers)
-
-# Step 8: Check for successful search request and parse search results
-if search_response.ok:
-    print("✅ Search request successful!")
-    search_soup = BeautifulSoup(search_response.text, "html.parser")
-
-    # Extract log entry titles and links
-    entries = search_soup.select("a[href^='/entry/']")[:100]
-    print(f"🔹 Found {len(entries)} results")
-
-    # Stop if no entries are found
-    if not entries:
-        print("✅ All entries processed successfully! No more results to fetch.")
-        exit()  # Exit cleanly
-
-   # Load filtering settings from settings.json
-    search_pattern = re.compile(settings.get("search_pattern", r"COIN_NPS Start_Run_\\d+"))
-    exclude_keywords = settings.get("exclude_keywords", [])
-
-    # If --filter is set, apply filtering; otherwise, keep all results
-    if args.filter:
-        print("✅ Filtering enabled. Applying search pattern and keyword exclusions.")
-    
-        # Apply regex filtering (only keep entries that match the expected pattern)
-        filtered_entries = [entry for entry in entries if search_pattern.search(entry.text.strip())]
-
-        # Apply keyword exclusion (remove entries with unwanted words)
-        filtered_entries = [entry for entry in filtered_entries
-                            if not any(exclude.lower() in entry.text.lower() for exclude in exclude_keywords)]
-
-        # Stop if no valid entries remain after filtering
-        if not filtered_entries:
-            print("⚠️ No entries matched the refined search criteria. Exiting.")
-            exit()
-    else:
-        print("⚠️ Filtering disabled. Processing all search results.")
-        filtered_entries = entries  # Use all results without filtering 
-        # Display a filtered preview of up to 5 results
-       
-    print("\n🔹 **Search Preview:**\n")
-    preview_count = min(10, len(filtered_entries))
-    for index, entry in enumerate(filtered_entries[:preview_count], start=1):
-        entry_title = entry.text.strip()
-        entry_url = urllib.parse.urljoin(BASE_URL, entry["href"])
-        print(f"{index}. 📄 {entry_title}")
-        print(f"   🔗 {entry_url}\n")
-
-    # Ask the user if they want to continue with the download
-    proceed = input("Do you want to proceed with downloading metadata files? (y/n): ").strip().lower()
-    if proceed != 'y':
-        print("🚫 Download canceled. Exiting script.")
-        exit()
- 
-    # Save all results to a file
-    with open("logbook_results.txt", "w") as file:
-        for entry in entries:
-            file.write(f"{entry.text.strip()} - {BASE_URL}{entry['href']}\n")
-
-    # If --quiet flag is set, do not print to terminal
-    if args.quiet:
-        print("✅ Full results saved to logbook_results.txt")
+def parse_html(content):
+    """Parses an HTML page into an lxml tree (lxml is only imported once a page needs parsing)."""
+    from lxml import html as lxml_html
+    return lxml_html.fromstring(content)
+
+def _download(session, run_folder, file_url):
+    """Downloads one attached file into the run folder (called from the download thread pool)."""
+    file_name = file_url.split("/")[-1]  # Extract filename
+    file_path = os.path.join(run_folder, file_name)  # Save inside run folder
+
+    # Skip files we already have, unless the server reports a different size (e.g. an interrupted download)
+    local_size = os.path.getsize(file_path) if os.path.isfile(file_path) else 0
+    if local_size > 0:
+        try:
+            head = session.head(file_url, headers={"Accept-Encoding": "identity"})  # Cheap on a kept-alive connection
+            remote_size = head.headers.get("Content-Length") if head.ok else "unknown"
+        except requests.RequestException:
+            remote_size = "unknown"  # Can't verify: download it again
+        if remote_size is None or remote_size == str(local_size):  # No size reported: trust the local copy
+            logging.info(f"Already have {file_path}")
+            return True
+
+    logging.info(f"Downloading {file_name} from {file_url}")
+
+    # Ask for the raw bytes: metadata files are small, so decompressing costs more than it saves
+    try:
+        file_response = session.get(file_url, stream=True, headers={"Accept-Encoding": "identity"})
+    except requests.RequestException as e:  # Retries exhausted: leave the run for the next invocation
+        tqdm.write(f"❌ Failed to download {file_name}: {e}")
+        return False
+    if file_response.status_code == 200:
+        file_response.raw.decode_content = True  # Undo any transfer gzip like iter_content did
+        with open(file_path, "wb") as file:
+            shutil.copyfileobj(file_response.raw, file, length=DOWNLOAD_CHUNK_SIZE)
+        logging.info(f"Saved {file_path}")
+        return True
     else:
-        print("\n".join([f"📄 Log Entry: {entry.text.strip()} - {BASE_URL}{entry['href']}" for entry in entries[:10]]))
-
-# Step 9: Extract & Download Metadata Files
-base_metadata_dir = "metadata"
-os.makedirs(base_metadata_dir, exist_ok=True)
-
-if args.no_download:
-    print("🚫 Downloading stage skipped due to --no-download or --debug flag.")
-    logging.info("Skipping file downloads.")
-else:
-    page = 0  # Start at the first page
-    max_pages = 100  # Prevent infinite loops
-
-while page < max_pages:
-    print(f"🔹 Fetching page {page}...")
-
-    # Update search payload with pagination
-    search_payload["page"] = page  # Ensure the correct page number is requested
-
-    # Encode URL with updated pagination
-    encoded_search_url = f"https://logbooks.jlab.org/entries?{urllib.parse.urlencode(search_payload)}"
+        tqdm.write(f"❌ Failed to download {file_name}")
+        return False
 
-    # Send paginated search request
-    search_response = session.get(encoded_search_url, headers=headers)
-
-    # Check for a valid response
-    if not search_response.ok:
-        print(f"❌ Failed to fetch page {page}. Stopping pagination.")
-        break  
-
-    search_soup = BeautifulSoup(search_response.text, "html.parser")
-
-    # Extract log entry titles and links
-    entries = search_soup.select("a[href^='/entry/']")
-    if not entries:
-        print("✅ No more entries to process. Pagination complete.")
-        break  # Stop if no more results
-
-    print(f"🔹 Found {len(entries)} results on page {page}")
-
-    for index, entry in enumerate(entries, start=1):
-        entry_title = entry.text.strip()
-        entry_url = urllib.parse.urljoin(BASE_URL, entry["href"])
-        print(f"🔹 Processing entry {index + (page * 100)}: {entry_title}")
-
-        # Extract run number using regex
-        match = re.search(r"50k replay plots for run (\d+)", entry_title, re.IGNORECASE)
-        run_number = match.group(1) if match else None
-
-        if not run_number:
-            print(f"⚠️ Skipping entry {entry_title} (Run number not found)")
-            continue  # Skip if no run number is detected
-
-        # Create a folder for this run number
-        run_folder_name = settings.get("output_folder_format", "COIN_NPS_50k_replay_{run_number}")
-        run_folder = os.path.join(base_metadata_dir, run_folder_name.format(run_number=run_number))
+def fetch_page(session, search_url, page):
+    """Fetches one page of search results and returns its parsed tree (None if the request failed)."""
+    page_url = f"{search_url}&page={page}"
+    try:
+        page_response = session.get(page_url)
+    except requests.RequestException as e:
+        tqdm.write(f"❌ Failed to fetch page {page}: {e}")
+        return None
+    if not page_response.ok:
+        tqdm.write(f"❌ Failed to fetch page {page}.")
+        return None
+    from lxml.etree import ParserError
+    try:
+        return parse_html(page_response.content)
+    except ParserError as e:  # e.g. an empty body
+        tqdm.write(f"❌ Failed to parse page {page}: {e}")
+        return None
+
+def count_pages(tree, pager_last_xpath):
+    """Reads the total number of result pages from the pager footer ('last' link is 0-based), or None if there is no pager."""
+    last_hrefs = pager_last_xpath(tree)
+    if not last_hrefs:
+        return None  # No pager: either everything fits on one page or the markup changed
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(last_hrefs[0]).query)
+    return int(query.get("page", ["0"])[0]) + 1
+
+# Entries whose files were all downloaded by an earlier invocation, so a rerun can pick up where it stopped
+# (keyed on the entry link, since one run can have several entries)
+def load_state(state_file):
+    """Loads the set of completed entry links from the state file (empty if there is none yet)."""
+    try:
+        with open(state_file, "r") as file:
+            return set(json.load(file).get("downloaded_entries", []))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return set()
+
+def save_state(state_file, downloaded_entries):
+    """Writes the completed entry links to the state file, replacing it atomically."""
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, "w") as file:
+        json.dump({"downloaded_entries": sorted(downloaded_entries)}, file, indent=4)
+    os.replace(tmp_file, state_file)
+
+def process_page(entries, page, entry_pool, handle_entry, downloaded_entries, state_file):
+    """Processes one page of search results concurrently and records the entries it completed."""
+    # Each entry fetches its entry page, then downloads its files; per-entry details go to debug.log
+    # and the terminal only gets a rate-limited progress bar
+    numbered_entries = [(index + (page * 100), entry) for index, entry in enumerate(entries, start=1)]
+
+    # Entries for the same run write the same files, so they are handled one after another in a single task
+    groups = {}
+    for entry_number, entry in numbered_entries:
+        match = RUN_RE.search(entry.text_content())
+        groups.setdefault(match.group(1) if match else entry_number, []).append((entry_number, entry))
+
+    results = entry_pool.map(lambda group: [handle_entry(*task) for task in group], groups.values())
+    completed = {href for hrefs in tqdm(results, total=len(groups), desc=f"Page {page}", unit="run") for href in hrefs if href}
+
+    # Record entries whose files all arrived, so a rerun skips them
+    if completed:
+        downloaded_entries.update(completed)
+        save_state(state_file, downloaded_entries)
+
+def process_entry(entry_number, entry, session, download_pool, downloaded_entries, metadata_dir, folder_fmt, file_links_xpath,
+                  created_dirs):
+    """Fetches one log entry page and downloads its files; returns the entry link if all were saved, else None."""
+    entry_title = entry.text_content().strip()
+    entry_url = urllib.parse.urljoin(BASE_URL, entry.get("href"))
+    logging.info(f"Processing entry {entry_number}: {entry_title}")
+
+    # Extract run number using regex
+    match = RUN_RE.search(entry_title)
+    run_number = match.group(1) if match else None
+
+    if not run_number:
+        logging.info(f"Skipping entry {entry_title} (Run number not found)")
+        return None  # Skip if no run number is detected
+
+    if entry.get("href") in downloaded_entries:
+        logging.info(f"Skipping entry {entry_title} (already downloaded)")
+        return None
+
+    # Create a folder for this run number (once per run; repeated run numbers across pages skip the syscalls)
+    run_folder = os.path.join(metadata_dir, folder_fmt.format(run_number=run_number))
+    if run_folder not in created_dirs:
         os.makedirs(run_folder, exist_ok=True)
+        created_dirs.add(run_folder)
 
-        # Fetch log entry page
+    # Fetch log entry page
+    try:
         entry_page = session.get(entry_url)
-        entry_soup = BeautifulSoup(entry_page.text, "html.parser")
-
-        # Load file types from settings.json
-        file_types = settings.get("file_types", [".dat"])  # Default to .dat if missing
-
-        # Create a selector for all file types
-        file_selectors = ",".join([f"a[href$='{ext}']" for ext in file_types])
-
-        # Find metadata files
-        file_links = entry_soup.select(file_selectors)
-
-        if not file_links:
-            print(f"⚠️ No metadata files found for Run {run_number}. Skipping download.")
-            continue  # Skip if no files are found
-
-        for file_link in file_links:
-            file_href = file_link["href"]  # Extract relative file path
-            file_url = urllib.parse.urljoin(BASE_URL, file_href)  # Ensure full URL
-            file_name = file_url.split("/")[-1]  # Extract filename
-
-            print(f"📥 Downloading: {file_name} from {file_url}")
-
-            # Download the file
-            file_response = session.get(file_url, stream=True)
-            if file_response.status_code == 200:
-                file_path = os.path.join(run_folder, file_name)  # Save inside run folder
-                with open(file_path, "wb") as file:
-                    for chunk in file_response.iter_content(chunk_size=8192):
-                        file.write(chunk)
-                print(f"✅ Saved: {file_path}")
-            else:
-                print(f"❌ Failed to download {file_name}")
-
-    # ✅ Move to the next page AFTER all processing
-    page += 1
-#if total_processed == 0:
-#    print("❌ Search failed! Possibly no valid results found. Server response:")
-if args.debug:
-    logging.debug(f"🔹 Final Response URL: {search_response.url}")
-    logging.debug(search_response.text[:1000])
-    # Elapsed time
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    logging.info(f"⏱️ Script execution time: {elapsed_time:.2f} seconds")
+    except requests.RequestException as e:
+        tqdm.write(f"❌ Failed to fetch entry for Run {run_number}: {e}")
+        return None
+    if not entry_page.ok:
+        tqdm.write(f"❌ Failed to fetch entry for Run {run_number}.")
+        return None
+    from lxml.etree import ParserError
+    try:
+        entry_tree = parse_html(entry_page.content)
+    except ParserError as e:  # e.g. an empty body
+        tqdm.write(f"❌ Failed to parse entry for Run {run_number}: {e}")
+        return None
+
+    # Find metadata files
+    file_links = file_links_xpath(entry_tree)
+
+    if not file_links:
+        tqdm.write(f"⚠️ No metadata files found for Run {run_number}. Skipping download.")
+        return None  # Skip if no files are found
+
+    # Download this entry's files in parallel over the shared session, overlapping other entries' page fetches
+    # (each file once: an attachment linked twice would otherwise be written by two threads at once)
+    file_urls = list(dict.fromkeys(urllib.parse.urljoin(BASE_URL, file_href) for file_href in file_links))
+    results = list(download_pool.map(lambda file_url: _download(session, run_folder, file_url), file_urls))
+    return entry.get("href") if all(results) else None
+
+def main():
+    start_time = time.time()
+
+    # Set up logging configuration
+    logging.basicConfig(
+        filename="debug.log",  # Log to a file
+        level=logging.DEBUG,  # Capture all debug messages
+        format="%(asctime)s - %(levelname)s - %(message)s",  # Include timestamp
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+    settings = load_settings()
+    args = parse_args()
+
+    # Ensure debug mode forces no-download
+    if args.debug:
+        args.no_download = True  # Debug mode should not download files
+        print("🛠️ Debugging mode enabled. Downloads are disabled.")
+        logging.info("Debugging mode enabled. Downloads are disabled.")
+
+    start_date = validate_date(args.start_date)
+    end_date = validate_date(args.end_date)
+
+    # Get username & password securely
+    username = input("Enter your JLab username: ")
+    password = getpass.getpass("Enter your JLab password: ")
+
+    # Start a session
+    # One keep-alive pool shared by all download threads, so each connection's TLS handshake is paid once
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=1,  # Only one host
+        pool_maxsize=ENTRY_WORKERS + DOWNLOAD_WORKERS + PAGE_WORKERS,  # A kept-alive connection for every thread
+        # Once retries run out, hand back the last response instead of raising, so the .ok checks still report failures
+        max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                          allowed_methods=["GET", "POST"], raise_on_status=False)
+    ))
+
+    # Step 1: Fetch login page to get `form_build_id`
+    login_page = session.get(BASE_URL)
+
+    # Extract form_build_id for login (a regex on the raw bytes; no need to parse the whole page)
+    match = FORM_BUILD_RE.search(login_page.content)
+    form_build_id = match.group(1).decode() if match else None
+
+    # Debugging
+    if args.debug and form_build_id:
+        logging.debug(f"🔹 Extracted form_build_id: {form_build_id}")
+    elif args.debug:
+        logging.warning("⚠️ No form_build_id found. Login may fail.")
+
+    # Step 2: Define login payload
+    login_payload = {
+        "name": username,
+        "pass": password,
+        "form_build_id": form_build_id,
+        "form_id": "user_login_block",
+        "op": "Log in"
+    }
+
+    # Step 3: Send login request
+    # Browser-like headers, set once on the session for every later request
+    # (requests adds the form Content-Type to the login POST itself)
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+        "Referer": BASE_URL,
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+        "Origin": "https://logbooks.jlab.org",
+        "Connection": "keep-alive",
+        "Upgrade-Insecure-Requests": "1"
+    }
+
+    session.headers.update(headers)
+
+    response = session.post(LOGIN_URL, data=login_payload)
+
+    # Step 4: Check if login was successful
+    if response.ok and LOGOUT_RE.search(response.content):
+        print("✅ Login successful!")
+    else:
+        print("❌ Login failed! The website may require additional fields.")
+        return
+
+    # Step 5: Fetch the search page to get `form_build_id` and `form_token`
+    search_page = session.get(SEARCH_URL)
+
+    # Extract new form_build_id and form_token for the search form
+    build_match = FORM_BUILD_RE.search(search_page.content)
+    token_match = FORM_TOKEN_RE.search(search_page.content)
+
+    form_build_id = build_match.group(1).decode() if build_match else None
+    form_token = token_match.group(1).decode() if token_match else None
+
+    # Debugging
+    if args.debug and form_build_id and form_token:
+        logging.debug(f"🔹 Extracted search form_build_id: {form_build_id}")
+        logging.debug(f"🔹 Extracted search form_token: {form_token}")
+    elif args.debug:
+        logging.warning("⚠️ No form_build_id or form_token found for search. Search may fail.")
+        return
+
+    # Step 6: Define search payload
+    search_payload = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "logbooks[0]": args.logbook,
+        "search_str": args.search,
+        "group_by": "SHIFT",
+        "listing_format": "table",
+        "entries_per_page": "100",
+        "form_build_id": form_build_id,
+        "form_token": form_token,
+        "form_id": "elog_form_advanced_filters",
+        "op": "Submit"
+    }
+    # Encode the parameters correctly for a GET request (once: result pages only append "&page=N")
+    encoded_search_url = f"{SEARCH_URL}?{urllib.parse.urlencode(search_payload)}"
+
+    # Step 7: Send the search request
+    search_response = session.get(encoded_search_url)
+
+    # Compiled XPath queries, reused for every page; lxml is only needed from here on
+    from lxml.etree import XPath, ParserError
+    entry_xpath = XPath(ENTRY_XPATH)
+    pager_last_xpath = XPath(PAGER_LAST_XPATH)
+    file_links_xpath = XPath(file_xpath(tuple(settings.get("file_types", [".dat"]))))  # Default to .dat if missing
+
+    # Step 8: Check for successful search request and parse search results
+    if search_response.ok:
+        print("✅ Search request successful!")
+        try:
+            search_tree = parse_html(search_response.content)
+        except ParserError as e:
+            print(f"❌ Search results could not be parsed: {e}")
+            return
+
+        # Extract log entry titles and links
+        entries = entry_xpath(search_tree)[:100]
+        print(f"🔹 Found {len(entries)} results")
+
+        # Stop if no entries are found
+        if not entries:
+            print("✅ All entries processed successfully! No more results to fetch.")
+            return  # Exit cleanly
+
+        # Load filtering settings from settings.json
+        search_pattern = re.compile(settings.get("search_pattern", r"COIN_NPS Start_Run_\\d+"))
+        exclude_keywords = settings.get("exclude_keywords", [])
+        if isinstance(exclude_keywords, str):  # Allow a single keyword (or "") instead of a list
+            exclude_keywords = [exclude_keywords] if exclude_keywords else []
+        # All keywords folded into one case-insensitive regex, so each title is scanned once in C
+        exclude_re = re.compile("|".join(map(re.escape, exclude_keywords)), re.IGNORECASE) if exclude_keywords else None
+
+        # If --filter is set, apply filtering; otherwise, keep all results
+        if args.filter:
+            print("✅ Filtering enabled. Applying search pattern and keyword exclusions.")
+
+            # Keep entries that match the expected pattern and contain none of the unwanted words (one pass)
+            filtered_entries = [entry for entry in entries
+                                if search_pattern.search(title := entry.text_content().strip())
+                                and not (exclude_re and exclude_re.search(title))]
+
+            # Stop if no valid entries remain after filtering
+            if not filtered_entries:
+                print("⚠️ No entries matched the refined search criteria. Exiting.")
+                return
+        else:
+            print("⚠️ Filtering disabled. Processing all search results.")
+            filtered_entries = entries  # Use all results without filtering
+
+        print("\n🔹 **Search Preview:**\n")
+        preview_count = min(10, len(filtered_entries))
+        for index, entry in enumerate(filtered_entries[:preview_count], start=1):
+            entry_title = entry.text_content().strip()
+            entry_url = urllib.parse.urljoin(BASE_URL, entry.get("href"))
+            print(f"{index}. 📄 {entry_title}")
+            print(f"   🔗 {entry_url}\n")
+
+        # Ask the user if they want to continue with the download
+        proceed = input("Do you want to proceed with downloading metadata files? (y/n): ").strip().lower()
+        if proceed != 'y':
+            print("🚫 Download canceled. Exiting script.")
+            return
+
+        # Save all results to a file
+        with open("logbook_results.txt", "w") as file:
+            for entry in entries:
+                file.write(f"{entry.text_content().strip()} - {BASE_URL}{entry.get('href')}\n")
+
+        # If --quiet flag is set, do not print to terminal
+        if args.quiet:
+            print("✅ Full results saved to logbook_results.txt")
+        else:
+            print("\n".join([f"📄 Log Entry: {entry.text_content().strip()} - {BASE_URL}{entry.get('href')}" for entry in entries[:10]]))
+
+    # Step 9: Extract & Download Metadata Files
+    base_metadata_dir = "metadata"
+    os.makedirs(base_metadata_dir, exist_ok=True)
+    state_file = os.path.join(base_metadata_dir, "state.json")
+
+    if args.no_download:
+        print("🚫 Downloading stage skipped due to --no-download or --debug flag.")
+        logging.info("Skipping file downloads.")
+    else:
+        max_pages = 100  # Prevent runaway page counts
+        downloaded_entries = load_state(state_file)
+        if downloaded_entries:
+            print(f"⏩ {len(downloaded_entries)} entries already downloaded according to {state_file}. They will be skipped.")
+        entry_pool = ThreadPoolExecutor(ENTRY_WORKERS)
+        download_pool = ThreadPoolExecutor(DOWNLOAD_WORKERS)
+        handle_entry = partial(process_entry, session=session, download_pool=download_pool,
+                               downloaded_entries=downloaded_entries, metadata_dir=base_metadata_dir,
+                               folder_fmt=settings.get("output_folder_format", "COIN_NPS_50k_replay_{run_number}"),
+                               file_links_xpath=file_links_xpath, created_dirs=set())
+
+        # Page 0 is the search we already ran for the preview; only fetch it again if that request failed.
+        # It also tells us how many pages there are, so the rest are fetched concurrently while it is processed.
+        first_tree = search_tree if search_response.ok else fetch_page(session, encoded_search_url, 0)
+        total_pages = count_pages(first_tree, pager_last_xpath) if first_tree is not None else 1
+        # A page with fewer than entries_per_page results is the last one, so a short first page means no more requests
+        per_page = int(search_payload["entries_per_page"])
+        first_full = first_tree is not None and len(entry_xpath(first_tree)) >= per_page
+        page_by_page = total_pages is None and first_full
+        if page_by_page:
+            print("🔹 First page is full but has no pager. Fetching further pages one at a time until a short one...")
+            total_pages = max_pages
+        elif total_pages is None or not first_full:
+            total_pages = 1
+        total_pages = min(total_pages, max_pages)
+        if total_pages > 1 and not page_by_page:
+            print(f"🔹 Fetching pages 1-{total_pages - 1}...")
+
+        seen_hrefs = set()  # Entries can shift between pages while fetching; process each only once
+        with ThreadPoolExecutor(PAGE_WORKERS) as page_pool:
+            fetch = partial(fetch_page, session, encoded_search_url)
+            # Without a page count, fetch lazily so the loop below stops at the first short page
+            later_trees = (map if page_by_page else page_pool.map)(fetch, range(1, total_pages))
+            for page, page_tree in enumerate(itertools.chain([first_tree], later_trees)):
+                if page_tree is None:
+                    print(f"❌ Page {page} unavailable. Stopping pagination.")
+                    break
+
+                # Extract log entry titles and links
+                page_entries = entry_xpath(page_tree)
+                entries = []
+                for entry in page_entries:  # Also drops repeated links within this page
+                    if entry.get("href") not in seen_hrefs:
+                        seen_hrefs.add(entry.get("href"))
+                        entries.append(entry)
+                if entries:
+                    process_page(entries, page, entry_pool, handle_entry, downloaded_entries, state_file)
+
+                # A short page is the last one; any later pages can only be empty
+                if len(page_entries) < per_page:
+                    break
+
+        entry_pool.shutdown()
+        download_pool.shutdown()
+
+    if args.debug:
+        logging.debug(f"🔹 Final Response URL: {search_response.url}")
+        logging.debug(search_response.text[:1000])
+        # Elapsed time
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+        logging.info(f"⏱️ Script execution time: {elapsed_time:.2f} seconds")
+
+if __name__ == "__main__":
+    main()